@@ -1,46 +1,108 @@
 import pandas as pd
 import numpy as np
+import functools
 import hashlib
-import hmac
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
 
 # A hardcoded key for HMAC to ensure reproducibility.
 # In real systems, this would be securely managed.
 HMAC_SECRET_KEY = b'bcse318l-secret-key-for-reproducible-tokenization'
+_SHA256_BLOCK_SIZE = 64
+# Tokens keep the first 10 bytes of the HMAC digest (20 hex characters).
+TOKEN_BYTES = 10
+
+# Generalization levels used by apply_k_anonymity.
+AGE_GENERALIZATIONS = [
+    ([0, 20, 30, 40, 50, 60, 70, 80, 90, 100],
+     ['0-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80-89', '90-99']),
+    ([0, 25, 50, 75, 100],
+     ['0-24', '25-49', '50-74', '75-99']),
+    ([0, 50, 100],
+     ['0-49', '50-99']),
+    ([0, 100],
+     ['0-99']),
+]
+ZIP_GENERALIZATIONS = [4, 3, 2, 1]
+
+# One shared categorical dtype per Age level, so every generalized frame
+# reuses the same category arrays instead of inferring fresh ones.
+AGE_DTYPES = [pd.CategoricalDtype(labels, ordered=True) for _, labels in AGE_GENERALIZATIONS]
 
 
 # --------------------------------------------------------
 # Generalization Functions
 # --------------------------------------------------------
-def generalize_age(df: pd.DataFrame, bins: List[int], labels: List[str]) -> pd.DataFrame:
+def generalize_age(ages: pd.Series, bins: List[int], labels: List[str],
+                   dtype: Optional[pd.CategoricalDtype] = None) -> pd.Series:
     """
-    Generalizes the 'Age' column into predefined buckets.
+    Generalizes an 'Age' column into predefined [low, high) buckets, like
+    pd.cut(..., right=False), optionally using a prebuilt categorical dtype
+    for those labels.
     """
-    df_copy = df.copy()
-    df_copy['Age'] = pd.cut(df_copy['Age'], bins=bins, labels=labels, right=False)
-    return df_copy
+    if dtype is None:
+        dtype = pd.CategoricalDtype(labels, ordered=True)
+    values = ages.to_numpy(dtype=float, na_value=np.nan)
+    # Bin directly into category codes; values outside the bins (or missing)
+    # get code -1, which the categorical treats as NaN.
+    codes = np.searchsorted(bins, values, side='right') - 1
+    codes[~((values >= bins[0]) & (values < bins[-1]))] = -1
+    return pd.Series(pd.Categorical.from_codes(codes, dtype=dtype), index=ages.index, name=ages.name)
 
 
-def generalize_zip(df: pd.DataFrame, precision: int) -> pd.DataFrame:
+def generalize_zip(zip_codes: pd.Series, precision: int) -> pd.Series:
     """
-    Generalizes the 'ZIP_Code' column by suppressing digits.
+    Generalizes a 'ZIP_Code' column by suppressing digits.
     """
-    df_copy = df.copy()
-    df_copy['ZIP_Code'] = (
-        df_copy['ZIP_Code']
-        .astype(str)
-        .str.slice(0, precision)
-        .str.pad(5, side='right', fillchar='*')
+    return pd.Series(
+        [zip_code[:precision].ljust(5, '*') for zip_code in zip_codes.astype(str).tolist()],
+        index=zip_codes.index,
+        name=zip_codes.name,
     )
-    return df_copy
 
 
 # --------------------------------------------------------
 # k-Anonymity Functions
 # --------------------------------------------------------
+def _prep_for_group(df: pd.DataFrame, qis: List[str]) -> pd.DataFrame:
+    """
+    Returns a view of the DataFrame with string QI columns converted to
+    categoricals so that groupby hashes integer codes.
+    """
+    return df.assign(**{qi: df[qi].astype('category') for qi in qis if df[qi].dtype == object})
+
+
 def get_equivalence_classes(df: pd.DataFrame, qis: List[str]) -> pd.core.groupby.generic.DataFrameGroupBy:
     """Groups the DataFrame by quasi-identifiers."""
-    return df.groupby(qis, observed=True)
+    return _prep_for_group(df, qis).groupby(qis, observed=True, sort=False)
+
+
+def _qi_codes(df: pd.DataFrame, qis: List[str]) -> np.ndarray:
+    """
+    Encodes each QI column as integer codes (N x Q); missing values become -1.
+    """
+    return np.column_stack([pd.factorize(df[qi])[0] for qi in qis])
+
+
+def _equivalence_class_sizes(codes: np.ndarray) -> np.ndarray:
+    """
+    Returns the size of every equivalence class in a QI code matrix.
+    Rows with a missing QI are ignored, as groupby would drop them.
+    """
+    codes = codes[(codes >= 0).all(axis=1)]
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Fold the columns into a single dense class id. Refactorizing after each
+    # column keeps the ids below N, so the combined keys cannot overflow.
+    class_ids = np.zeros(len(codes), dtype=np.int64)
+    for column in codes.T:
+        class_ids, _ = pd.factorize(class_ids * (column.max() + 1) + column)
+    return np.bincount(class_ids)
+
+
+def _min_group_size(codes: np.ndarray) -> int:
+    """Returns the size of the smallest equivalence class in a QI code matrix."""
+    class_sizes = _equivalence_class_sizes(codes)
+    return int(class_sizes.min()) if class_sizes.size > 0 else 0
 
 
 def check_k_anonymity(df: pd.DataFrame, qis: List[str], k: int) -> bool:
@@ -49,52 +111,57 @@ def check_k_anonymity(df: pd.DataFrame, qis: List[str], k: int) -> bool:
     """
     if df.empty:
         return True
-    eq_classes = get_equivalence_classes(df, qis)
-    return eq_classes.size().min() >= k
+    return _min_group_size(_qi_codes(df, qis)) >= k
 
 
 def apply_k_anonymity(df: pd.DataFrame, qis: List[str], k: int) -> pd.DataFrame:
     """
     Applies k-anonymity using simple generalization of 'Age' and 'ZIP_Code'.
     """
+    # A single working frame whose QI columns are overwritten at each level.
     anonymized_df = df.copy()
-    
-    # Define generalization levels.
-    age_generalizations = [
-        ([0, 20, 30, 40, 50, 60, 70, 80, 90, 100],
-         ['0-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80-89', '90-99']),
-        ([0, 25, 50, 75, 100],
-         ['0-24', '25-49', '50-74', '75-99']),
-        ([0, 50, 100],
-         ['0-49', '50-99']),
-        ([0, 100],
-         ['0-99']),
-    ]
-    zip_generalizations = [4, 3, 2, 1]
+
+    # Every level recombines the same few generalized columns, so build each
+    # Age and ZIP variant once instead of regeneralizing the raw data per level.
+    age_variants = []
+    if 'Age' in qis:
+        age_variants = [
+            generalize_age(df['Age'], bins=age_bins, labels=age_labels, dtype=age_dtype)
+            for (age_bins, age_labels), age_dtype in zip(AGE_GENERALIZATIONS, AGE_DTYPES)
+        ]
+    zip_variants = []
+    if 'ZIP_Code' in qis:
+        zip_variants = [
+            generalize_zip(df['ZIP_Code'], precision=zip_prec)
+            for zip_prec in ZIP_GENERALIZATIONS
+        ]
+
+    # Factorize the QIs once; each level only swaps in the precomputed codes of
+    # the generalized columns, so the k-check never rehashes any values.
+    qi_codes = _qi_codes(anonymized_df, qis)
+    age_variant_codes = [pd.factorize(variant)[0] for variant in age_variants]
+    zip_variant_codes = [pd.factorize(variant)[0] for variant in zip_variants]
 
     gen_level = 0
-    temp_df = df.copy()
 
-    while not check_k_anonymity(anonymized_df, qis, k):
+    while not anonymized_df.empty and _min_group_size(qi_codes) < k:
         print(f"k={k} not met. Applying generalization level {gen_level + 1}...")
 
-        temp_df = df.copy()
         age_level_idx = gen_level // 2
         zip_level_idx = (gen_level - 1) // 2
 
         # Apply Age generalization
         if 'Age' in qis:
-            current_age_level = min(age_level_idx, len(age_generalizations) - 1)
-            age_bins, age_labels = age_generalizations[current_age_level]
-            temp_df = generalize_age(temp_df, bins=age_bins, labels=age_labels)
+            current_age_level = min(age_level_idx, len(age_variants) - 1)
+            anonymized_df['Age'] = age_variants[current_age_level]
+            qi_codes[:, qis.index('Age')] = age_variant_codes[current_age_level]
 
         # Apply ZIP generalization
         if 'ZIP_Code' in qis and zip_level_idx >= 0:
-            current_zip_level = min(zip_level_idx, len(zip_generalizations) - 1)
-            zip_prec = zip_generalizations[current_zip_level]
-            temp_df = generalize_zip(temp_df, precision=zip_prec)
+            current_zip_level = min(zip_level_idx, len(zip_variants) - 1)
+            anonymized_df['ZIP_Code'] = zip_variants[current_zip_level]
+            qi_codes[:, qis.index('ZIP_Code')] = zip_variant_codes[current_zip_level]
 
-        anonymized_df = temp_df.copy()
         gen_level += 1
         if gen_level > 10:
             print("Error: Could not achieve k-anonymity after multiple generalization steps.")
@@ -111,28 +178,54 @@ def check_l_diversity(df: pd.DataFrame, sensitive_col: str, qis: List[str], l_va
     """
     Checks if a k-anonymous DataFrame satisfies l-diversity.
     """
-    eq_classes = get_equivalence_classes(df, qis)
-    failing_groups = []
-
-    for name, group in eq_classes:
-        diversity = group[sensitive_col].dropna().nunique()
-        if diversity < l_val:
-            failing_groups.append((name, diversity))
+    diversity = get_equivalence_classes(df, qis)[sensitive_col].nunique(dropna=True)
+    failing = diversity[diversity < l_val]
+    # A single QI yields scalar index labels; wrap them so every group name is
+    # a tuple of QI values, as when iterating over the groupby.
+    failing_groups = [
+        (name if isinstance(name, tuple) else (name,), diversity)
+        for name, diversity in zip(failing.index, failing.tolist())
+    ]
 
     return len(failing_groups) == 0, failing_groups
 
 
-def tokenize_ids(df: pd.DataFrame, id_col: str) -> Tuple[pd.DataFrame, Dict[str, str]]:
+def _hmac_templates(key: bytes) -> Tuple[Any, Any]:
     """
-    Replaces a column of identifiers with non-reversible HMAC-based tokens.
+    Returns SHA-256 contexts that have already absorbed the HMAC inner and
+    outer padded key blocks.
     """
-    df_tokenized = df.copy()
+    if len(key) > _SHA256_BLOCK_SIZE:
+        key = hashlib.sha256(key).digest()
+    key = key.ljust(_SHA256_BLOCK_SIZE, b'\x00')
+    inner = hashlib.sha256(bytes(b ^ 0x36 for b in key))
+    outer = hashlib.sha256(bytes(b ^ 0x5c for b in key))
+    return inner, outer
+
 
-    def generate_token(value: str) -> str:
-        return hmac.new(HMAC_SECRET_KEY, value.encode('utf-8'), hashlib.sha256).hexdigest()
+_HMAC_INNER, _HMAC_OUTER = _hmac_templates(HMAC_SECRET_KEY)
 
-    df_tokenized[id_col] = df_tokenized[id_col].apply(generate_token)
-    token_vault = dict(zip(df[id_col], df_tokenized[id_col]))
+
+def _generate_token(value: str) -> str:
+    """
+    Computes the truncated HMAC-SHA256 token of a single identifier.
+    """
+    inner = _HMAC_INNER.copy()
+    inner.update(value.encode('utf-8'))
+    outer = _HMAC_OUTER.copy()
+    outer.update(inner.digest())
+    return outer.digest()[:TOKEN_BYTES].hex()
+
+
+def tokenize_ids(df: pd.DataFrame, id_col: str) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """
+    Replaces a column of identifiers with non-reversible HMAC-based tokens,
+    truncated to TOKEN_BYTES bytes of the digest.
+    """
+    df_tokenized = df.copy()
+    # Hash each distinct ID once, then map the column through the vault.
+    token_vault = {value: _generate_token(value) for value in df[id_col].unique().tolist()}
+    df_tokenized[id_col] = df[id_col].map(token_vault)
 
     return df_tokenized, token_vault
 
@@ -144,13 +237,29 @@ def simulate_linkage_attack(df: pd.DataFrame, attacker_qis: List[str]) -> float:
     """
     Simulates a linkage attack to calculate the re-identification risk.
     """
-    eq_classes = get_equivalence_classes(df, attacker_qis)
-    group_sizes = eq_classes.size()
+    group_sizes = _equivalence_class_sizes(_qi_codes(df, attacker_qis))
     num_unique = (group_sizes == 1).sum()
     total_records = len(df)
     return num_unique / total_records if total_records > 0 else 0
 
 
+@functools.lru_cache(maxsize=32)
+def _interval_widths(labels: Tuple[Any, ...]) -> np.ndarray:
+    """
+    Parses 'low-high' interval labels (or plain values) into a lookup table
+    of widths indexed by categorical code. A trailing NaN entry makes code -1
+    (a missing value) map to a missing width. The same generalization labels
+    recur across every NCP call, so tables are cached per label set; the
+    shared table is returned read-only.
+    """
+    bounds = [str(label).split('-') for label in labels]
+    low = pd.to_numeric(pd.Series([b[0] for b in bounds]), errors='coerce')
+    high = pd.to_numeric(pd.Series([b[1] if len(b) > 1 else None for b in bounds]), errors='coerce')
+    widths = np.append((high.fillna(low) - low).abs().to_numpy(dtype=float), np.nan)
+    widths.flags.writeable = False
+    return widths
+
+
 def compute_ncp(original_df: pd.DataFrame, anonymized_df: pd.DataFrame, qis: List[str]) -> float:
     """
     Computes the Normalized Certainty Penalty (NCP) for the anonymized dataset.
@@ -169,24 +278,23 @@ def compute_ncp(original_df: pd.DataFrame, anonymized_df: pd.DataFrame, qis: Lis
             if total_range == 0:
                 continue
 
-            series_str = anonymized_df[qi].astype(str)
-            intervals = series_str.str.split('-', expand=True)
-
-            if intervals.shape[1] == 1:
-                low = pd.to_numeric(intervals[0], errors='coerce')
-                high = low.copy()
-            else:
-                low = pd.to_numeric(intervals[0], errors='coerce')
-                high = pd.to_numeric(intervals[1], errors='coerce')
-
-            high = high.fillna(low)
-            generalized_ranges = (high - low).abs()
-            qi_ncp = (generalized_ranges / total_range).sum()
+            # Look each row's interval width up by its categorical code.
+            ages = anonymized_df[qi].astype('category')
+            widths = _interval_widths(tuple(ages.cat.categories))
+            generalized_ranges = widths[ages.cat.codes.to_numpy()]
+            qi_ncp = np.nansum(generalized_ranges) / total_range
 
         else:
             # Categorical attribute (ZIP_Code, Gender)
             if qi == 'ZIP_Code':
-                masked_chars = anonymized_df[qi].astype(str).str.count(r'\*')
+                # Compare a fixed-width byte view of the UTF-8 encoded column
+                # against '*'; multi-byte characters never contain that byte.
+                zip_bytes = np.array(
+                    [zip_code.encode('utf-8') for zip_code in anonymized_df[qi].astype(str).tolist()],
+                    dtype=bytes,
+                )
+                zip_chars = zip_bytes.view(np.uint8).reshape(len(zip_bytes), zip_bytes.itemsize)
+                masked_chars = (zip_chars == ord('*')).sum(axis=1)
                 qi_ncp = (masked_chars / 5).sum()
             # Gender is not generalized in this plan, so its NCP = 0
 
@@ -1,7 +1,8 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 import matplotlib.pyplot as plt
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, StratifiedShuffleSplit
 from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.compose import ColumnTransformer
@@ -10,7 +11,8 @@ from sklearn.metrics import accuracy_score
 import os
 import json
 from datetime import datetime
-from typing import List
+from typing import List, Optional, Tuple
+from pandas.api.types import is_numeric_dtype
 
 # Import our custom privacy functions
 from anonymize import (
@@ -35,7 +37,16 @@ SENSITIVE_ATTRIBUTE = 'Diagnosis'
 ID_COLUMN = 'Patient_ID'
 PII_TO_DROP = ['Name'] # Explicitly list PII to drop
 
-def run_ml_utility_test(df: pd.DataFrame, qis: List[str], target: str, is_anonymized: bool) -> float:
+def prepare_target(df: pd.DataFrame, target: str) -> pd.Series:
+    """
+    Returns the target column with NA values filled, so that stratification
+    does not fail on missing labels.
+    """
+    return df[target].fillna('Missing')
+
+
+def run_ml_utility_test(df: pd.DataFrame, qis: List[str], target: str, is_anonymized: bool,
+                        split_indices: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> float:
     """
     Trains a Logistic Regression model and returns its accuracy.
     
@@ -44,22 +55,20 @@ def run_ml_utility_test(df: pd.DataFrame, qis: List[str], target: str, is_anonym
         qis: List of feature columns (quasi-identifiers).
         target: The target column name.
         is_anonymized: Flag indicating if the data is generalized.
+        split_indices: Optional precomputed (train, test) row positions, which
+            must refer to a frame with the same rows in the same order as df.
+            When omitted, a stratified split is computed from the target.
     
     Returns:
         The accuracy score of the model.
     """
-    # Fill NA values in the target column to avoid errors during stratification
-    df_ml = df.copy()
-    if df_ml[target].isna().any():
-        df_ml[target] = df_ml[target].fillna('Missing')
+    X = df[qis]
+    y = prepare_target(df, target)
 
-    if df_ml[target].nunique() < 2:
+    if y.nunique() < 2:
         print("Warning: Target variable has less than 2 unique classes. Cannot train model.")
         return 0.0
 
-    X = df_ml[qis]
-    y = df_ml[target]
-
     # The preprocessor needs to handle different data types
     # For original data: Age is numeric, others are categorical.
     # For anonymized data: All QIs are treated as categorical.
@@ -68,8 +77,8 @@ def run_ml_utility_test(df: pd.DataFrame, qis: List[str], target: str, is_anonym
         numerical_features = []
     else:
         # ** FIX: Ensure ZIP_Code is treated as object for ML **
-        categorical_features = [qi for qi in qis if df_ml[qi].dtype == 'object' or qi == 'ZIP_Code']
-        numerical_features = [qi for qi in qis if df_ml[qi].dtype != 'object' and qi != 'ZIP_Code']
+        categorical_features = [qi for qi in qis if not is_numeric_dtype(df[qi]) or qi == 'ZIP_Code']
+        numerical_features = [qi for qi in qis if is_numeric_dtype(df[qi]) and qi != 'ZIP_Code']
 
     preprocessor = ColumnTransformer(
         transformers=[
@@ -82,7 +91,16 @@ def run_ml_utility_test(df: pd.DataFrame, qis: List[str], target: str, is_anonym
     pipeline = Pipeline(steps=[('preprocessor', preprocessor),
                                ('classifier', LogisticRegression(random_state=RANDOM_SEED, max_iter=1000))])
     
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=RANDOM_SEED, stratify=y)
+    if split_indices is None:
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=RANDOM_SEED, stratify=y)
+    else:
+        train_idx, test_idx = split_indices
+        if len(train_idx) + len(test_idx) != len(df):
+            raise ValueError(
+                f"split_indices cover {len(train_idx) + len(test_idx)} rows, but the DataFrame has {len(df)}."
+            )
+        X_train, X_test = X.iloc[train_idx], X.iloc[test_idx]
+        y_train, y_test = y.iloc[train_idx], y.iloc[test_idx]
     
     pipeline.fit(X_train, y_train)
     y_pred = pipeline.predict(X_test)
@@ -96,7 +114,8 @@ def main():
     # Load original dataset
     try:
         # ** FIX: Ensure ZIP_Code is read as a string **
-        original_df = pd.read_csv(INPUT_FILE, dtype={'ZIP_Code': str})
+        # Strings are stored as Arrow arrays rather than Python objects.
+        original_df = pd.read_csv(INPUT_FILE, dtype={'ZIP_Code': pd.ArrowDtype(pa.string())}, dtype_backend='pyarrow')
     except FileNotFoundError:
         print(f"Error: '{INPUT_FILE}' not found. Please run 'generate_dataset.py' first.")
         return
@@ -147,13 +166,13 @@ def main():
     final_anonymized_df = final_anonymized_df.drop(columns=PII_TO_DROP, errors='ignore')
     
     # Save the *final, secure* dataset
-    final_anonymized_df.to_csv(ANONYMIZED_OUTPUT_FILE, index=False)
+    final_anonymized_df.to_csv(ANONYMIZED_OUTPUT_FILE, index=False, lineterminator='\n')
     print(f"Saved *final, secure* anonymized data to '{ANONYMIZED_OUTPUT_FILE}'")
     
     print("Tokenization complete. Sample of secure token vault (first 5 entries):")
     for i, (original_id, token) in enumerate(token_vault.items()):
         if i >= 5: break
-        print(f"  Original ID: {original_id} -> Token: {token[:20]}...")
+        print(f"  Original ID: {original_id} -> Token: {token}")
 
     # --- 5. Data Utility Metrics ---
     print("\n--- 5. Data Utility Metrics ---")
@@ -163,8 +182,17 @@ def main():
     
     # 5b. Machine Learning Utility
     print("Running Machine Learning utility tests...")
-    accuracy_original = run_ml_utility_test(original_df, QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTE, is_anonymized=False)
-    accuracy_k3_l2 = run_ml_utility_test(final_anonymized_df, QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTE, is_anonymized=True)
+    # Anonymization keeps the row order and the target column, so a single
+    # stratified split (the same one train_test_split would draw) is shared
+    # by every data version.
+    y_all = prepare_target(original_df, SENSITIVE_ATTRIBUTE)
+    splitter = StratifiedShuffleSplit(n_splits=1, test_size=0.3, random_state=RANDOM_SEED)
+    split_indices = next(splitter.split(np.zeros(len(y_all)), y_all))
+
+    accuracy_original = run_ml_utility_test(original_df, QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTE, is_anonymized=False,
+                                            split_indices=split_indices)
+    accuracy_k3_l2 = run_ml_utility_test(final_anonymized_df, QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTE, is_anonymized=True,
+                                         split_indices=split_indices)
     print(f"ML Accuracy on Original Data: {accuracy_original:.4f}")
     print(f"ML Accuracy on Anonymized (k=3, l=2) Data: {accuracy_k3_l2:.4f}")
 
@@ -174,10 +202,19 @@ def main():
     ncp_values = [0.0] # NCP for original data is 0
     accuracy_values = [accuracy_original]
     
+    # k=3 was already measured on the final tokenized data in step 5.
+    ncp_cache = {3: ncp_k3_l2}
+    accuracy_cache = {3: accuracy_k3_l2}
+
     for k in k_values:
         df = anonymized_results[k]['df']
-        ncp_values.append(compute_ncp(original_df, df, QUASI_IDENTIFIERS))
-        accuracy_values.append(run_ml_utility_test(df, QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTE, is_anonymized=True))
+        if k not in ncp_cache:
+            ncp_cache[k] = compute_ncp(original_df, df, QUASI_IDENTIFIERS)
+        if k not in accuracy_cache:
+            accuracy_cache[k] = run_ml_utility_test(df, QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTE, is_anonymized=True,
+                                                    split_indices=split_indices)
+        ncp_values.append(ncp_cache[k])
+        accuracy_values.append(accuracy_cache[k])
 
     fig, ax1 = plt.subplots(figsize=(10, 6))
 
@@ -1,7 +1,6 @@
 import pandas as pd
 import numpy as np
 from faker import Faker
-import uuid
 import os
 
 # --- Configuration ---
@@ -27,17 +26,27 @@ def create_synthetic_dataset(num_rows: int) -> pd.DataFrame:
     """
     print(f"Generating {num_rows} synthetic patient records...")
     
+    ages = np.random.randint(18, 90, size=num_rows)
+    genders = np.random.choice(['M', 'F', 'Other'], size=num_rows, p=[0.48, 0.48, 0.04])
+    diagnoses = np.random.choice(
+        ['Asthma', 'Diabetes', 'Hypertension', 'None', 'Flu'],
+        size=num_rows,
+        p=[0.15, 0.25, 0.10, 0.40, 0.10]
+    )
+
+    # IDs and ZIP codes are drawn in bulk from the seeded generator (after the
+    # columns above, so their values are unchanged) instead of per-row calls.
+    id_bytes = np.random.bytes(16 * num_rows)
+    patient_ids = [id_bytes[i * 16:(i + 1) * 16].hex() for i in range(num_rows)]
+    zip_codes = np.char.zfill(np.random.randint(0, 100000, size=num_rows).astype('U5'), 5)
+
     data = {
-        'Patient_ID': [str(uuid.uuid4()) for _ in range(num_rows)],
+        'Patient_ID': patient_ids,
         'Name': [fake.name() for _ in range(num_rows)],
-        'Age': np.random.randint(18, 90, size=num_rows),
-        'Gender': np.random.choice(['M', 'F', 'Other'], size=num_rows, p=[0.48, 0.48, 0.04]),
-        'ZIP_Code': [fake.zipcode() for _ in range(num_rows)],
-        'Diagnosis': np.random.choice(
-           ['Asthma', 'Diabetes', 'Hypertension', 'None', 'Flu'],  # <-- This list was added
-            size=num_rows,
-            p=[0.15, 0.25, 0.10, 0.40, 0.10]
-        )
+        'Age': ages,
+        'Gender': genders,
+        'ZIP_Code': zip_codes,
+        'Diagnosis': diagnoses
     }
     
     df = pd.DataFrame(data)